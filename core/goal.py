@@ -1,21 +1,82 @@
 # knuckledragger/core/goal.py
 
-from knuckledragger.recursion.rssn import Shape
+from recursion.ftc import _density_cached, batch_density
+from recursion.rssn import Shape
+
 
 class Goal:
     """
     A recursive logic goal, defined not by Boolean satisfaction,
     but by achieving sufficient truth-density.
     """
+    __slots__ = ("_dirty", "_max_depth", "_satisfied", "_shape", "_shape_key", "_threshold")
+
     def __init__(self, shape: Shape, threshold: float = 0.95, max_depth: int = 10):
-        self.shape = shape
         self.threshold = threshold
         self.max_depth = max_depth
+        self.shape = shape
+
+    def __reduce__(self):
+        return (Goal, (self._shape, self._threshold, self._max_depth))
+
+    @property
+    def shape(self) -> Shape:
+        return self._shape
+
+    @shape.setter
+    def shape(self, shape: Shape):
+        # Replacing the shape invalidates the cached satisfaction result
+        self._shape = shape
+        self._shape_key = shape.key()
+        self._dirty = True
+
+    # Checked on assignment; density code downstream trusts them
+    @property
+    def threshold(self) -> float:
+        return self._threshold
 
-    def is_satisfied(self) -> bool:
-        from knuckledragger.recursion.ftc import compute_density
-        density = compute_density(self.shape, self.max_depth)
-        return density >= self.threshold
+    @threshold.setter
+    def threshold(self, threshold: float):
+        if not 0.0 <= threshold <= 1.0:
+            raise ValueError(f"threshold must be in [0, 1], got {threshold}")
+        self._threshold = threshold
+        self._dirty = True
+
+    @property
+    def max_depth(self) -> int:
+        return self._max_depth
+
+    @max_depth.setter
+    def max_depth(self, max_depth: int):
+        if max_depth < 1 or max_depth != int(max_depth):
+            raise ValueError(f"max_depth must be a positive integer, got {max_depth}")
+        self._max_depth = int(max_depth)
+        self._dirty = True
+
+    # _density is bound as a default so the hot call resolves it as a local, not a global
+    def is_satisfied(self, _density=_density_cached) -> bool:
+        if self._dirty:
+            density = _density(self._shape_key, self._max_depth, self._threshold)
+            self._satisfied = density >= self._threshold
+            self._dirty = False
+        return self._satisfied
 
     def __repr__(self):
+        # Shapes print their whole tree; keep this O(1) for logging inside search loops
+        return f"Goal(shape=<{type(self.shape).__name__} id=0x{id(self.shape):x}>, threshold={self.threshold})"
+
+    def verbose_repr(self) -> str:
         return f"Goal(shape={self.shape}, threshold={self.threshold})"
+
+def batch_is_satisfied(goals: list[Goal]) -> list[bool]:
+    """
+    Check many goals at once, e.g. all sibling states of a search expansion.
+    Goals whose shapes changed are evaluated together in a single batched density kernel call.
+    """
+    dirty = [g for g in goals if g._dirty]
+    if dirty:
+        densities = batch_density([g.shape.flatten(g.max_depth) for g in dirty])
+        for g, density in zip(dirty, densities, strict=True):
+            g._satisfied = density >= g._threshold
+            g._dirty = False
+    return [g._satisfied for g in goals]
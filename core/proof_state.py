@@ -1,28 +1,70 @@
 # knuckledragger/core/proof_state.py
 
-from knuckledragger.core.goal import Goal
-from knuckledragger.recursion.rssn import Shape
+from collections import deque
+
+from core.goal import Goal
+from recursion.rssn import Shape
+
 
 class ProofState:
     """
     Represents the evolving state of a recursive proof
     through transformations of logical shapes.
     """
+    __slots__ = ("_sat_cache", "_seen", "_version", "goal", "history", "looped", "steps")
+
     def __init__(self, goal: Goal):
         self.goal = goal
-        self.history = [goal.shape]
+        # Only the last max_depth + 1 shapes are kept so old shapes can be collected
+        self.history = deque([goal.shape], maxlen=goal.max_depth + 1)
+        self.steps = 1
+        # Bumped on every tactic application; is_proven answers from cache while unchanged
+        self._version = 0
+        self._sat_cache = (-1, False)
+        # Structural keys of every shape reached. Revisiting one means the tactics are cycling.
+        # Keys are interned nodes (see Shape.key), so each entry is one reference to structure
+        # shared by every shape and state, not a copy of the tree.
+        self._seen = {goal._shape_key}
+        self.looped = False
+
+    @property
+    def history_list(self) -> list[Shape]:
+        return list(self.history)
 
     def apply_tactic(self, tactic):
         """
         Applies a tactic, transforming the shape and recording history.
-        Tactic must return a new Shape.
+        Tactic must return either a new Shape, or a (path, sub-shape) pair
+        replacing only that part of the current shape (see Shape.with_replaced).
         """
-        new_shape = tactic.apply(self.goal)
+        result = tactic.apply(self.goal)
+        if isinstance(result, tuple):
+            path, new_sub = result
+            new_shape = self.goal.shape.with_replaced(path, new_sub)
+        else:
+            new_shape = result
         self.history.append(new_shape)
+        self.steps += 1
+        self._version += 1
         self.goal.shape = new_shape
+        if self.goal._shape_key in self._seen:
+            self.looped = True
+        else:
+            self._seen.add(self.goal._shape_key)
+        # Searches check is_proven right after every step; settle it while the new shape is at hand
+        self._sat_cache = (self._version, self.goal.is_satisfied())
 
     def is_proven(self) -> bool:
-        return self.goal.is_satisfied()
+        """
+        Whether the current shape satisfies the goal. Independent of `looped`,
+        which searches check separately to prune states that revisit a shape.
+        """
+        version, sat = self._sat_cache
+        if version == self._version:
+            return sat
+        sat = self.goal.is_satisfied()
+        self._sat_cache = (self._version, sat)
+        return sat
 
     def __repr__(self):
-        return f"ProofState(goal={self.goal}, steps={len(self.history)})"
+        return f"ProofState(goal={self.goal}, steps={self.steps})"
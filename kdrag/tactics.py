@@ -6,13 +6,28 @@ import kdrag as kd
 import kdrag.smt as smt
 import kdrag.config
 import kdrag.rewrite
+import concurrent.futures
+import contextlib
+import functools
 from enum import IntEnum
 import operator as op
-from typing import NamedTuple, Optional, Sequence, Callable
+from typing import Any, NamedTuple, Optional, Sequence, Callable
 import pprint
 import time
 
 
+# Symbols and operators of the Calc._Mode members, in order
+_MODE_NAMES = ("==", "<=", "<", ">", ">=")
+# The operator module is typed for comparable values, not z3 terms; take any operands
+_MODE_OPS: tuple[Callable[[Any, Any], smt.BoolRef], ...] = (
+    op.eq,
+    op.le,
+    op.lt,
+    op.gt,
+    op.ge,
+)
+
+
 class Calc:
     """
     Calc is for equational reasoning.
@@ -27,13 +42,11 @@ class Calc:
         GE = 4
 
         def __str__(self):
-            names = ["==", "<=", "<", ">", ">="]
-            return names[self]
+            return _MODE_NAMES[self]
 
         @property
         def op(self):
-            ops = [op.eq, op.le, op.lt, op.gt, op.ge]
-            return ops[self]
+            return _MODE_OPS[self]
 
         def trans(self, y):
             """Allowed transitions"""
@@ -51,31 +64,52 @@ class Calc:
         self.lhs = lhs
         self.iterm = lhs  # intermediate term
         self.assume = assume
-        self.lemma = kd.kernel.prove(self._forall(smt.Eq(lhs, lhs)))
+        # Hypothesis of every step, built once (see _forall)
+        if len(assume) == 0:
+            self._hyp = None
+        elif len(assume) == 1:
+            self._hyp = assume[0]
+        else:
+            self._hyp = smt.And(assume)
+        self.steps = []  # proofs of `iterm op rhs` for each step
+        self._kwargs = {}
+        self._lemma = None
         self.mode = self._Mode.EQ
 
+    @property
+    def lemma(self) -> kd.kernel.Proof:
+        """
+        Proof of `lhs op iterm`. The steps are chained by transitivity in one solver call, made on first access.
+        """
+        if self._lemma is None:
+            self._lemma = kd.prove(
+                self._forall(self.mode.op(self.lhs, self.iterm)),
+                by=list(self.steps),
+                **self._kwargs,
+            )
+        return self._lemma
+
     def _forall(
         self, body: smt.BoolRef | smt.QuantifierRef
     ) -> smt.BoolRef | smt.QuantifierRef:
-        if len(self.assume) == 1:
-            body = smt.Implies(self.assume[0], body)
-        elif len(self.assume) > 1:
-            body = smt.Implies(smt.And(self.assume), body)
+        if self._hyp is not None:
+            body = smt.Implies(self._hyp, body)
         if len(self.vars) == 0:
             return body
         else:
             return smt.ForAll(self.vars, body)
 
-    def _lemma(self, rhs, by, **kwargs):
+    def _step(self, rhs, by, **kwargs):
         op = self.mode.op
-        l = kd.kernel.prove(self._forall(op(self.iterm, rhs)), by=by, **kwargs)
-        self.lemma = kd.prove(
-            self._forall(op(self.lhs, rhs)), by=[l, self.lemma], **kwargs
+        self.steps.append(
+            kd.kernel.prove(self._forall(op(self.iterm, rhs)), by=by, **kwargs)
         )
+        self._kwargs.update(kwargs)
+        self._lemma = None
         self.iterm = rhs
 
     def eq(self, rhs, by=[], **kwargs):
-        self._lemma(rhs, by, **kwargs)
+        self._step(rhs, by, **kwargs)
         return self
 
     def _set_mode(self, newmode):
@@ -87,22 +121,22 @@ class Calc:
 
     def le(self, rhs, by=[]):
         self._set_mode(Calc._Mode.LE)
-        self._lemma(rhs, by)
+        self._step(rhs, by)
         return self
 
     def lt(self, rhs, by=[]):
         self._set_mode(Calc._Mode.LT)
-        self._lemma(rhs, by)
+        self._step(rhs, by)
         return self
 
     def ge(self, rhs, by=[]):
         self._set_mode(Calc._Mode.GE)
-        self._lemma(rhs, by)
+        self._step(rhs, by)
         return self
 
     def gt(self, rhs, by=[]):
         self._set_mode(Calc._Mode.GT)
-        self._lemma(rhs, by)
+        self._step(rhs, by)
         return self
 
     def __repr__(self):
@@ -148,6 +182,162 @@ def forallI(
 
 simps = {}
 
+_CACHE_SIZE = 4096
+"""
+Entries each of the memo tables in this module keeps before evicting its oldest.
+"""
+
+
+def _remember(cache: dict, key, value):
+    """
+    Store `value` in one of the memo tables, evicting the oldest entry when the table is full.
+    """
+    if len(cache) >= _CACHE_SIZE:
+        del cache[next(iter(cache))]
+    cache[key] = value
+    return value
+
+
+_prove_cache: dict[tuple, kd.kernel.Proof] = {}
+"""
+Successful kernel proofs keyed by the id of the theorem and the identities of the `by` proofs,
+so a hit cites the very lemmas (admitted or not) it was asked to use.
+A cached proof holds on to its theorem and lemmas, so the ids in its key cannot be reused.
+"""
+
+
+def clear_prove_cache():
+    """
+    Forget all memoized proofs, unfoldings, rules, matches, context conjunctions and unsat cores.
+    """
+    for cache in (
+        _prove_cache,
+        _unfold_cache,
+        _and_cache,
+        _unsat_core_cache,
+        _rule_cache,
+        _rule_decomp_cache,
+        _backward_cache,
+    ):
+        cache.clear()
+
+
+def _share(timeout) -> int:
+    """
+    Timeout in milliseconds for a cheaper attempt made before the plain query.
+    """
+    return max(1, int(timeout) // 4)
+
+
+def _remaining(timeout, start: float) -> int:
+    """
+    Milliseconds left of `timeout` since `start` (a `time.perf_counter()` reading), at least 1.
+    """
+    return max(1, int(timeout - (time.perf_counter() - start) * 1000))
+
+
+# Probes for fragments with a dedicated z3 tactic, tried in order
+_LOGIC_TACTICS = (
+    ("is-qfbv", "qfbv"),
+    ("is-qflia", "qflia"),
+    ("is-qflra", "qflra"),
+    ("is-qfnra", "qfnra-nlsat"),
+)
+
+
+def _z3_solver() -> Callable[[], smt.Solver] | None:
+    """The z3 solver class if z3 is the configured backend (see `kdrag.config.solver`), else None."""
+    z3solver = getattr(smt, "Z3Solver", None)
+    return z3solver if kdrag.config.solver is z3solver else None
+
+
+def _logic_solver(
+    thm: smt.BoolRef, by: list[kd.kernel.Proof]
+) -> Callable[[], smt.Solver] | None:
+    """
+    Solver factory running the dedicated z3 tactic for the fragment the query `by |- thm` falls in,
+    after simplification and equation solving. None if the query is in no such fragment or z3 is not the backend.
+    """
+    if _z3_solver() is None or not all(isinstance(p, kd.kernel.Proof) for p in by):
+        return None
+    g = smt.Goal()
+    g.add(*[p.thm for p in by], smt.Not(thm))
+    for probe, tactic in _LOGIC_TACTICS:
+        if smt.Probe(probe)(g) == 1.0:
+            return lambda: smt.Then("simplify", "solve-eqs", tactic).solver()
+    return None
+
+
+def _kernel_prove(
+    thm: smt.BoolRef,
+    by: kd.kernel.Proof | Sequence[kd.kernel.Proof] = (),
+    admit=False,
+    timeout=1000,
+    dump=False,
+    solver=None,
+) -> kd.kernel.Proof:
+    """
+    `kd.kernel.prove`, memoized on the theorem, the set of lemma proofs and `admit`.
+    Timeout and solver only matter for failures, which are not cached.
+    """
+    by = [by] if isinstance(by, kd.kernel.Proof) else list(by)
+    if dump or not all(isinstance(p, kd.kernel.Proof) for p in by):
+        return kd.kernel.prove(
+            thm, by, timeout=timeout, dump=dump, solver=solver, admit=admit
+        )
+    key = (thm.get_id(), tuple(sorted({id(p) for p in by})), admit)
+    pf = _prove_cache.get(key)
+    if pf is None:
+        pf = kd.kernel.prove(thm, by, timeout=timeout, solver=solver, admit=admit)
+        _remember(_prove_cache, key, pf)
+    return pf
+
+
+_unfold_cache: dict[
+    tuple[int, int], tuple[smt.BoolRef, smt.BoolRef, list[kd.kernel.Proof]]
+] = {}
+"""
+`prove(thm, unfold=k)` results keyed by `(thm.get_id(), k)`: the theorem itself (kept so its id is not reused),
+the unfolded theorem and the definition lemmas used.
+"""
+
+
+def _ground_instances(
+    thm: smt.BoolRef, by: list[kd.kernel.Proof]
+) -> list[kd.kernel.Proof] | None:
+    """
+    Replace every universally quantified lemma in `by` with its instances at the subterms of `thm`
+    matching the lemma's trigger: the left hand side of an (optionally guarded) equation, otherwise its body.
+    Returns None when there is nothing to gain: `thm` is quantified, no lemma is, or some lemma has no instance.
+    """
+    if (
+        isinstance(thm, smt.QuantifierRef)
+        or not all(isinstance(p, kd.kernel.Proof) for p in by)
+        or not any(isinstance(p.thm, smt.QuantifierRef) for p in by)
+    ):
+        return None
+    terms = list({t.get_id(): t for t in kd.utils.subterms(thm)}.values())
+    ground = []
+    for p in by:
+        if not isinstance(p.thm, smt.QuantifierRef):
+            ground.append(p)
+            continue
+        if not p.thm.is_forall():
+            return None
+        vs, body = kd.utils.open_binder(p.thm)
+        if smt.is_implies(body):
+            body = body.arg(1)
+        pat = body.arg(0) if smt.is_eq(body) else body
+        found = False
+        for t in terms:
+            subst = kd.utils.pmatch(vs, pat, t)
+            if subst is not None and len(subst) == len(vs):
+                ground.append(kd.kernel.instan([subst[v] for v in vs], p))
+                found = True
+        if not found:
+            return None
+    return ground
+
 
 def prove(
     thm: smt.BoolRef,
@@ -218,16 +408,49 @@ def prove(
 
     if unfold != 0:
         assert isinstance(unfold, int)
-        trace = []
-        thm1 = thm
-        for i in range(unfold):
-            thm1 = kd.rewrite.unfold(thm1, trace=trace)
+        key = (thm.get_id(), unfold)
+        if key in _unfold_cache:
+            _, thm1, trace = _unfold_cache[key]
+        else:
+            trace = []
+            thm1 = thm
+            for i in range(unfold):
+                thm1 = kd.rewrite.unfold(thm1, trace=trace)
+            _remember(_unfold_cache, key, (thm, thm1, trace))
         # It is arguable if we're better off dumping trace into by or hiding trace
         if not thm.eq(thm1):
-            by.append(kd.kernel.prove(thm == thm1, by=trace, timeout=timeout))  # type: ignore
+            by.append(_kernel_prove(thm == thm1, by=trace, timeout=timeout))  # type: ignore
+    logic = None if solver is not None else _logic_solver
+    budget_start = time.perf_counter()
+    if not admit and not dump:
+        # Cheaper queries are tried first. The plain query below is the fallback and reports failures.
+        # A quantifier free query built from instances spares the solver from instantiating
+        # the quantified lemmas itself, and queries in a decidable fragment get a dedicated tactic.
+        # They get a quarter of the timeout and the fallback the rest, so hard goals still give up in time.
+        ground = _ground_instances(thm, by)
+        attempts = (
+            [(by, None)]
+            if ground is None
+            else [(ground, kdrag.config.solver if solver is None else solver)]
+        )
+        for lemmas, default in attempts:
+            s = (logic and logic(thm, lemmas)) or default
+            if s is None:
+                continue
+            try:
+                pf = _kernel_prove(thm, lemmas, timeout=_share(timeout), solver=s)
+                kdrag.config.perf_event("prove", thm, time.perf_counter() - start_time)
+                return pf
+            except kd.kernel.LemmaError:
+                pass
     try:
-        pf = kd.kernel.prove(
-            thm, by, timeout=timeout, dump=dump, solver=solver, admit=admit
+        pf = _kernel_prove(
+            thm,
+            by,
+            timeout=_remaining(timeout, budget_start),
+            dump=dump,
+            solver=solver,
+            admit=admit,
         )
         kdrag.config.perf_event("prove", thm, time.perf_counter() - start_time)
         return pf
@@ -253,8 +476,150 @@ def prove(
         raise e
 
 
+_and_cache: dict[tuple[int, ...], smt.BoolRef] = {}
+"""
+Conjunctions of goal contexts keyed by the ids of the hypotheses. Sibling goals share their context,
+so they get the same term. The conjunction references its hypotheses, so their ids cannot be reused.
+"""
+
+
+def _and_ctx(ctx: list[smt.BoolRef]) -> smt.BoolRef:
+    key = tuple(h.get_id() for h in ctx)
+    conj = _and_cache.get(key)
+    if conj is None:
+        conj = _remember(_and_cache, key, smt.And(ctx))
+    return conj
+
+
+_unsat_core_cache: dict[int, tuple[smt.BoolRef, list[frozenset[int]]]] = {}
+"""
+Unsat cores of previous `Lemma.auto` queries, keyed by goal id, next to the goal (kept so its id is not reused).
+A core is the set of ids of the lemma theorems and context hypotheses that sufficed.
+"""
+
+
+def _auto_prove(
+    ctx: list[smt.BoolRef], goal: smt.BoolRef, by: list[kd.kernel.Proof], timeout=1000
+) -> kd.kernel.Proof:
+    """
+    Prove `Implies(And(ctx), goal)`, handing the kernel only the lemmas of an unsat core.
+    A core recorded for the same goal is reused when all of its members are still available.
+    Otherwise, if there are several lemmas to choose from, `_auto_core` finds one and it is recorded for sibling subgoals.
+    If the kernel fails on the core lemmas, the query is retried with all of `by`.
+    """
+    start = time.perf_counter()
+    thm = smt.Implies(_and_ctx(ctx), goal)
+    lemmas = {p.thm.get_id(): p for p in by}
+    avail = lemmas.keys() | {h.get_id() for h in ctx}
+    _, cores = _unsat_core_cache.get(goal.get_id(), (goal, []))
+    for core in cores:
+        if core <= avail:
+            try:
+                return prove(
+                    thm, by=[lemmas[i] for i in core if i in lemmas], timeout=timeout
+                )
+            except kd.kernel.LemmaError:
+                break
+    z3solver = _z3_solver()
+    if z3solver is None or len(by) < 2:
+        return prove(thm, by=by, timeout=_remaining(timeout, start))
+    core = _auto_core(z3solver(), ctx, goal, by, _remaining(timeout, start))
+    if core is not None:
+        hit = _unsat_core_cache.get(goal.get_id())
+        if hit is None:
+            hit = _remember(_unsat_core_cache, goal.get_id(), (goal, []))
+        hit[1].append(core)
+        try:
+            return prove(
+                thm,
+                by=[p for i, p in lemmas.items() if i in core],
+                timeout=_remaining(timeout, start),
+            )
+        except kd.kernel.LemmaError:
+            pass
+    return prove(thm, by=by, timeout=_remaining(timeout, start))
+
+
+def _auto_core(
+    s: smt.Solver,
+    ctx: list[smt.BoolRef],
+    goal: smt.BoolRef,
+    by: list[kd.kernel.Proof],
+    timeout=1000,
+) -> frozenset[int] | None:
+    """
+    Unsat core of `by, ctx |- goal` as ids of lemma theorems and hypotheses, or None if the query is not unsat.
+    Each lemma and hypothesis is asserted into the fresh solver `s` guarded by a tracking literal.
+    """
+    lits = []
+    for e in [p.thm for p in by] + ctx:
+        lit = smt.Bool(f"KNUCKLEDRAGGER_HYP_{e.get_id()}")
+        s.add(smt.Implies(lit, e))
+        lits.append(lit)
+    s.add(smt.Not(goal))
+    s.set("timeout", timeout)
+    if s.check(*lits) != smt.unsat:
+        return None
+    return frozenset(int(str(c).rsplit("_", 1)[1]) for c in s.unsat_core())
+
+
+_rule_cache: dict[int, kd.rewrite.RewriteRule] = {}
+"""
+Rewrite rules of lemmas used by `simp`, keyed by theorem id.
+Each rule keeps its proof, and so its theorem, alive, so the id cannot be reused.
+"""
+
+
+_rule_decomp_cache: dict[
+    int, tuple[smt.BoolRef, list[smt.ExprRef], smt.ExprRef, smt.ExprRef]
+] = {}
+"""
+Context hypotheses used as rules by `Lemma.rewrite`, opened once: the hypothesis itself
+(kept so its id is not reused), the fresh variables, and the two sides of the equation.
+"""
+
+
+def _rule_of_lemma(lem: kd.kernel.Proof) -> kd.rewrite.RewriteRule:
+    rule = _rule_cache.get(lem.thm.get_id())
+    if rule is None:
+        rule = _remember(_rule_cache, lem.thm.get_id(), kd.rewrite.rewrite_of_expr(lem))
+    return rule
+
+
+_backward_cache: dict[
+    tuple[int, int],
+    tuple[
+        smt.BoolRef,
+        smt.BoolRef,
+        kd.rewrite.Rule,
+        tuple[dict[smt.ExprRef, smt.ExprRef], smt.BoolRef],
+    ],
+] = {}
+"""
+Successful `Lemma.apply` matches keyed by the ids of the applied theorem and of the goal:
+both terms (kept so their ids are not reused), the rule and the result of `backward_rule`.
+"""
+
+
+def _backward(
+    thm: smt.BoolRef, goal: smt.BoolRef
+) -> tuple[kd.rewrite.Rule, tuple[dict[smt.ExprRef, smt.ExprRef], smt.BoolRef] | None]:
+    """
+    `backward_rule(rule_of_expr(thm), goal)` together with the rule. Failed matches are not cached.
+    """
+    key = (thm.get_id(), goal.get_id())
+    hit = _backward_cache.get(key)
+    if hit is None:
+        rule = kd.rewrite.rule_of_expr(thm)
+        substgoal = kd.rewrite.backward_rule(rule, goal)
+        if substgoal is None:
+            return rule, None
+        hit = _remember(_backward_cache, key, (thm, goal, rule, substgoal))
+    return hit[2], hit[3]
+
+
 def simp(t: smt.ExprRef, by: list[kd.kernel.Proof] = [], **kwargs) -> kd.kernel.Proof:
-    rules = [kd.rewrite.rewrite_of_expr(lem.thm) for lem in by]
+    rules = [_rule_of_lemma(lem) for lem in by]
     t1 = kd.rewrite.rewrite_once(t, rules)
     return prove(smt.Eq(t, t1), by=by, **kwargs)
 
@@ -274,10 +639,119 @@ def subst(
     vs1, ab = kd.kernel.herb(
         smt.ForAll(vs, smt.substitute_vars(pf.thm.body(), *reversed(subst)))
     )
-    a = kd.kernel.instan([smt.substitute(t, *zip(vs, vs1)) for t in subst], pf)
+    # subst is written over vs, which herb has replaced by fresh constants vs1
+    renaming = list(zip(vs, vs1))
+    a = kd.kernel.instan([smt.substitute(t, *renaming) for t in subst], pf)
     return kd.kernel.modus(ab, a)
 
 
+@functools.lru_cache(maxsize=1024)
+def _head_decls(t: smt.ExprRef) -> frozenset[int]:
+    """
+    Ids of the head symbols of the subterms of `t`, not entering binders.
+    Cached, since a goal is typically tried against several rules before it changes.
+    """
+    return frozenset(x.decl().get_id() for x in kd.utils.subterms(t) if smt.is_app(x))
+
+
+def _pmatch_head(
+    vs: list[smt.ExprRef], pat: smt.ExprRef, t: smt.ExprRef
+) -> tuple[smt.ExprRef, dict[smt.ExprRef, smt.ExprRef]] | None:
+    """
+    `kd.utils.pmatch_rec` for patterns with a fixed head symbol.
+    Subterms are visited in the same order, but only those with the pattern's head are matched against it.
+    """
+    if (
+        not smt.is_app(pat)
+        or any(pat.eq(v) for v in vs)
+        or (smt.is_select(pat) and any(pat.arg(0).eq(v) for v in vs))
+    ):
+        return kd.utils.pmatch_rec(vs, pat, t)
+    decl = pat.decl()
+    if decl.get_id() not in _head_decls(t):
+        return None
+    for t1 in kd.utils.subterms(t):
+        if smt.is_app(t1) and t1.decl() == decl:
+            subst = kd.utils.pmatch(vs, pat, t1)
+            if subst is not None:
+                return t1, subst
+    return None
+
+
+def _check_smt2(smt2: str, names: list[str], timeout: int) -> list[str] | None:
+    """
+    Worker for `Lemma.auto_all`. Checks an SMT-LIB query in a fresh z3 process and returns the
+    names of the tracked lemmas in its unsat core, or None if the query was not shown unsat.
+    """
+    import z3
+
+    s = z3.Solver()
+    s.set("timeout", timeout)
+    s.from_string(smt2)
+    if s.check(*[z3.Bool(n) for n in names]) == z3.unsat:
+        return [str(c) for c in s.unsat_core()]
+    return None
+
+
+class _Stack:
+    """
+    Persistent stack supporting the list operations tactics use (append, extend, pop, [-1]).
+    Copies share their nodes, so `copy` is O(1) and mutating a copy never affects the original.
+    Iteration goes from bottom to top, like a list.
+    """
+
+    __slots__ = ("_len", "_top")
+
+    def __init__(self, items=()):
+        self._top = None  # (item, rest of stack)
+        self._len = 0
+        self.extend(items)
+
+    def append(self, x):
+        self._top = (x, self._top)
+        self._len += 1
+
+    def extend(self, xs):
+        for x in xs:
+            self.append(x)
+
+    def pop(self):
+        if self._top is None:
+            raise IndexError("pop from empty stack")
+        x, self._top = self._top
+        self._len -= 1
+        return x
+
+    def __getitem__(self, i):
+        if i == -1 and self._top is not None:
+            return self._top[0]
+        return list(self)[i]
+
+    def __setitem__(self, i, x):
+        if i != -1 or self._top is None:
+            raise IndexError("only the top of a stack can be replaced")
+        self._top = (x, self._top[1])
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        items = []
+        node = self._top
+        while node is not None:
+            items.append(node[0])
+            node = node[1]
+        return reversed(items)
+
+    def copy(self) -> "_Stack":
+        cpy = _Stack()
+        cpy._top, cpy._len = self._top, self._len
+        return cpy
+
+    def __repr__(self):
+        return repr(list(self))
+
+
 class Goal(NamedTuple):
     # TODO: also put eigenvariables, unification variables in here
     sig: list[smt.ExprRef]
@@ -287,16 +761,16 @@ class Goal(NamedTuple):
     def __repr__(self):
         if self.is_empty():
             return "Nothing to do!"
-        ctxrepr = pprint.pformat(self.ctx)
+        ctxrepr = _pformat(self.ctx)
         goalrepr = repr(self.goal)
         if len(ctxrepr) + len(goalrepr) <= 75:
-            goalctx = ctxrepr + " ?|- " + repr(self.goal)
+            goalctx = ctxrepr + " ?|- " + goalrepr
         else:
-            goalctx = ctxrepr + "\n?|- " + repr(self.goal)
+            goalctx = ctxrepr + "\n?|- " + goalrepr
         if len(self.sig) == 0:
             return goalctx
         else:
-            sigrepr = pprint.pformat(self.sig)
+            sigrepr = _pformat(self.sig)
             if len(sigrepr) + len(goalctx) >= 80:
                 return repr(self.sig) + ";\n" + goalctx
             else:
@@ -304,16 +778,23 @@ class Goal(NamedTuple):
 
     @classmethod
     def empty(cls) -> "Goal":
-        return Goal(
-            [],
-            [],
-            smt.Or(
-                smt.BoolVal(True), smt.Bool("KNUCKLEDRAGGER_EMPTYGOAL")
-            ),  # trivial _and_ specially marked
-        )
+        return Goal([], [], _empty_goal())
 
     def is_empty(self) -> bool:
-        return self == Goal.empty()
+        return not self.sig and not self.ctx and self.goal.eq(_empty_goal())
+
+
+@functools.cache
+def _empty_goal() -> smt.BoolRef:
+    return smt.Or(
+        smt.BoolVal(True), smt.Bool("KNUCKLEDRAGGER_EMPTYGOAL")
+    )  # trivial _and_ specially marked
+
+
+def _pformat(x) -> str:
+    # pprint only changes the layout of reprs that do not fit in its 80 column width
+    r = repr(x)
+    return r if len(r) <= 80 else pprint.pformat(x)
 
 
 class Lemma:
@@ -329,15 +810,16 @@ class Lemma:
 
     def __init__(self, goal: smt.BoolRef):
         self.start_time = time.perf_counter()
-        self.lemmas = []
+        self.lemmas = _Stack()
         self.thm = goal
-        self.goals = [Goal(sig=[], ctx=[], goal=goal)]
+        self.goals = _Stack([Goal(sig=[], ctx=[], goal=goal)])
         self.pushed = None
 
     def copy(self):
         """
         Lemma methods mutates the proof state. This can make you a copy.
         Does not copy the pushed Lemma stack.
+        Goals and lemmas are persistent stacks, so copying is constant time.
 
         >>> p,q = smt.Bools("p q")
         >>> l = Lemma(smt.Implies(p,q))
@@ -377,7 +859,7 @@ class Lemma:
         Pop state off the Lemma stack.
         """
         assert self.pushed is not None
-        self.lemmas = self.pushed.lemmas  # maybe we should store lemmas incrementally?
+        self.lemmas = self.pushed.lemmas
         self.goals = self.pushed.goals
         self.pushed = self.pushed.pushed
         return self.top_goal()
@@ -514,7 +996,8 @@ class Lemma:
                 newgoal = kd.rewrite.simp(oldgoal, trace=self.lemmas)
             else:
                 newgoal = smt.simplify(oldgoal)
-                self.lemmas.append(kd.kernel.prove(oldgoal == newgoal))
+                if not newgoal.eq(oldgoal):
+                    self.lemmas.append(_kernel_prove(oldgoal == newgoal))
             # if newgoal.eq(oldgoal):
             #    raise ValueError(
             #        "Simplify failed. Goal is already simplified.", oldgoal
@@ -526,7 +1009,7 @@ class Lemma:
             new = smt.simplify(old)
             if new.eq(old):
                 raise ValueError("Simplify failed. Ctx is already simplified.")
-            self.lemmas.append(kd.kernel.prove(old == new))
+            self.lemmas.append(_kernel_prove(old == new))
             self.goals[-1] = goalctx._replace(
                 ctx=oldctx[:at] + [new] + oldctx[at + 1 :]
             )
@@ -574,13 +1057,80 @@ class Lemma:
     def auto(self, **kwargs):
         """
         `auto` discharges a goal using z3. It forwards all parameters to `kd.prove`
+        When only `by` and `timeout` are given, the lemmas are first narrowed to an unsat core,
+        which is remembered for sibling goals (see `_auto_prove`).
         """
         goalctx = self.goals[-1]
         ctx, goal = goalctx.ctx, goalctx.goal
-        self.lemmas.append(kd.prove(smt.Implies(smt.And(ctx), goal), **kwargs))
+        by = kwargs.get("by", [])
+        if isinstance(by, kd.kernel.Proof):
+            by = [by]
+        if kwargs.keys() <= {"by", "timeout"} and all(
+            isinstance(p, kd.kernel.Proof) for p in by
+        ):
+            self.lemmas.append(
+                _auto_prove(ctx, goal, list(by), timeout=kwargs.get("timeout", 1000))
+            )
+        else:
+            self.lemmas.append(kd.prove(smt.Implies(_and_ctx(ctx), goal), **kwargs))
         self.goals.pop()
         return self.top_goal()
 
+    def auto_all(self, by=(), timeout=1000, parallel=False, max_workers=None):
+        """
+        Discharge every open goal, as by calling `auto` until none are left.
+        With `parallel`, the solver queries run at once in a pool of z3 worker processes.
+        Starting the pool costs more than a few easy queries, so it only pays off for many or hard goals.
+        Each worker reports the unsat core of its query, and the kernel then proves the goal from just the core lemmas.
+        Goals that could not be proven stay open and are reported in a LemmaError.
+
+        >>> p = smt.Bool("p")
+        >>> l = Lemma(smt.And(True, smt.Or(p, smt.Not(p))))
+        >>> _ = l.split()
+        >>> l.auto_all()
+        Nothing to do!
+        """
+        if isinstance(by, kd.kernel.Proof):
+            by = [by]
+        z3solver = _z3_solver()
+        if not parallel or len(self.goals) < 2 or z3solver is None:
+            while len(self.goals) > 0:
+                self.auto(by=by, timeout=timeout)
+            return self.top_goal()
+        goals = list(self.goals)
+        names = [f"KNUCKLEDRAGGER_BY_{i}" for i in range(len(by))]
+        queries = []
+        for goalctx in goals:
+            s = z3solver()
+            for name, p in zip(names, by, strict=True):
+                s.add(smt.Implies(smt.Bool(name), p.thm))
+            s.add(smt.Not(smt.Implies(_and_ctx(goalctx.ctx), goalctx.goal)))
+            queries.append(s.sexpr())
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as pool:
+            futures = [pool.submit(_check_smt2, q, names, timeout) for q in queries]
+            concurrent.futures.wait(futures)
+        failed = []
+        for goalctx, future in zip(goals, futures, strict=True):
+            thm = smt.Implies(_and_ctx(goalctx.ctx), goalctx.goal)
+            if (
+                future.exception() is not None
+            ):  # e.g. the query did not survive SMT-LIB printing
+                lemmas = by
+            elif (result := future.result()) is None:
+                failed.append(goalctx)
+                continue
+            else:
+                core = set(result)
+                lemmas = [p for name, p in zip(names, by, strict=True) if name in core]
+            try:
+                self.lemmas.append(_kernel_prove(thm, lemmas, timeout=timeout))
+            except kd.kernel.LemmaError:
+                failed.append(goalctx)
+        self.goals = _Stack(failed)
+        if failed:
+            raise kd.kernel.LemmaError("auto_all failed to prove goals", failed)
+        return self.top_goal()
+
     def einstan(self, n):
         """
         einstan opens an exists quantifier in context and returns the fresh eigenvariable.
@@ -646,7 +1196,7 @@ class Lemma:
                 x = smt.FreshConst(ext_ind.sort())
                 newgoal = smt.Eq(lhs[x], rhs[x])
                 self.lemmas.append(
-                    kd.kernel.prove(
+                    _kernel_prove(
                         smt.Implies(x == ext_ind, smt.Eq(lhs, rhs) == newgoal)
                     )
                 )
@@ -797,17 +1347,39 @@ class Lemma:
             raise ValueError(
                 "Rewrite tactic failed. Not a proof or context index", rule
             )
-        if isinstance(rulethm, smt.QuantifierRef) and rulethm.is_forall():
-            vs, body = kd.utils.open_binder(rulethm)
-        else:
-            vs = []
-            body = rulethm
-        if smt.is_eq(body):
-            lhs, rhs = body.arg(0), body.arg(1)
-            if rev:
-                lhs, rhs = rhs, lhs
+        is_forall = isinstance(rulethm, smt.QuantifierRef) and rulethm.is_forall()
+        if isinstance(rule, int):
+            decomp = _rule_decomp_cache.get(rulethm.get_id())
+            if decomp is None:
+                if isinstance(rulethm, smt.QuantifierRef) and rulethm.is_forall():
+                    vs, body = kd.utils.open_binder(rulethm)
+                else:
+                    vs = []
+                    body = rulethm
+                if not smt.is_eq(body):
+                    raise ValueError(
+                        f"Rewrite tactic failed. Not an equality {rulethm}"
+                    )
+                decomp = (rulethm, vs, body.arg(0), body.arg(1))
+                _remember(_rule_decomp_cache, rulethm.get_id(), decomp)
+            _, vs, lhs, rhs = decomp
         else:
-            raise ValueError(f"Rewrite tactic failed. Not an equality {rulethm}")
+            # Proofs are compiled once and shared with `simp` (see _rule_cache)
+            try:
+                vs, lhs, rhs, _ = _rule_of_lemma(rule)
+            except kd.rewrite.RewriteRuleException as e:
+                raise ValueError(
+                    f"Rewrite tactic failed. Not an equality {rulethm}"
+                ) from e
+            nvars = (
+                rulethm.num_vars()
+                if is_forall and isinstance(rulethm, smt.QuantifierRef)
+                else 0
+            )
+            if len(vs) != nvars:  # nested quantifiers
+                raise ValueError(f"Rewrite tactic failed. Not an equality {rulethm}")
+        if rev:
+            lhs, rhs = rhs, lhs
         if at is None:
             target = goal
         elif isinstance(at, int):
@@ -816,7 +1388,7 @@ class Lemma:
             raise ValueError(
                 "Rewrite tactic failed. `at` is not an index into the context"
             )
-        t_subst = kd.utils.pmatch_rec(vs, lhs, target)
+        t_subst = _pmatch_head(vs, lhs, target)
         if t_subst is None:
             raise ValueError(
                 f"Rewrite tactic failed to apply lemma {rulethm} to goal {goal}"
@@ -824,10 +1396,21 @@ class Lemma:
         else:
             self.goals.pop()
             lhs1, subst = t_subst
-            rhs1 = smt.substitute(rhs, *[(v, t) for v, t in subst.items()])
-            target: smt.BoolRef = smt.substitute(target, (lhs1, rhs1))
+            ts = [subst[v] for v in vs]
             if isinstance(rulethm, smt.QuantifierRef) and rulethm.is_forall():
-                self.lemmas.append(kd.kernel.instan2([subst[v] for v in vs], rulethm))
+                # Instantiate the de Bruijn body directly, as instan2 does
+                rhs1 = smt.substitute_vars(
+                    rulethm.body().arg(0 if rev else 1), *reversed(ts)
+                )
+            else:
+                rhs1 = rhs
+            # Every occurrence of lhs1 is replaced, so a walk is only needed below the root
+            if lhs1.eq(target):
+                target = rhs1
+            elif not lhs1.eq(rhs1):
+                target = smt.substitute(target, (lhs1, rhs1))
+            if is_forall:
+                self.lemmas.append(kd.kernel.instan2(ts, rulethm))
             if not isinstance(rule, int) and kd.kernel.is_proof(rule):
                 self.lemmas.append(rule)
             if at is None:
@@ -869,8 +1452,8 @@ class Lemma:
         ctxgoal = self.top_goal()
         if smt.is_eq(ctxgoal.goal):
             self.lemmas.append(
-                kd.kernel.prove(
-                    smt.Implies(smt.And(ctxgoal.ctx), ctxgoal.goal.arg(1) == rhs),
+                _kernel_prove(
+                    smt.Implies(_and_ctx(ctxgoal.ctx), ctxgoal.goal.arg(1) == rhs),
                     **kwargs,
                 )
             )
@@ -947,8 +1530,7 @@ class Lemma:
             thm = pf.thm
         else:
             raise ValueError("Apply tactic failed. Not a proof or context index", thm)
-        rule = kd.rewrite.rule_of_expr(thm)
-        substgoal = kd.rewrite.backward_rule(rule, goal)
+        rule, substgoal = _backward(thm, goal)
         if substgoal is None:
             raise ValueError(f"Apply tactic failed to apply lemma {pf} to goal {goal} ")
         else:
@@ -1033,7 +1615,7 @@ class Lemma:
         """
         goalctx = self.goals.pop()
         self.lemmas.append(
-            kd.kernel.prove(smt.Implies(smt.And(goalctx.ctx), conc), **kwargs)
+            _kernel_prove(smt.Implies(_and_ctx(goalctx.ctx), conc), **kwargs)
         )
         self.goals.append(goalctx._replace(ctx=goalctx.ctx + [conc]))
         return self.top_goal()
@@ -1075,8 +1657,21 @@ class Lemma:
         if "by" in kwargs:
             kwargs["by"].extend(self.lemmas)
         else:
-            kwargs["by"] = self.lemmas
-        pf = kd.kernel.prove(self.thm, **kwargs)
+            kwargs["by"] = list(self.lemmas)
+        pf = None
+        timeout = kwargs.get("timeout", 1000)
+        budget_start = time.perf_counter()
+        if not any(kwargs.get(k) for k in ("solver", "admit", "dump")):
+            # As in `prove`, a query in a decidable fragment first gets the dedicated tactic
+            s = _logic_solver(self.thm, kwargs["by"])
+            if s is not None:
+                with contextlib.suppress(kd.kernel.LemmaError):
+                    pf = _kernel_prove(
+                        self.thm, kwargs["by"], timeout=_share(timeout), solver=s
+                    )
+        if pf is None:
+            kwargs["timeout"] = _remaining(timeout, budget_start)
+            pf = _kernel_prove(self.thm, **kwargs)
         kdrag.config.perf_event(
             "Lemma", self.thm, time.perf_counter() - self.start_time
         )
@@ -1,38 +1,231 @@
 # knuckledragger/recursion/ftc.py
 
-from knuckledragger.recursion.rssn import Shape
-from typing import List
+from __future__ import annotations
 
-# Computes the density of a recursive shape across increasing depth levels
-def compute_density(shape: Shape, max_depth: int = 10) -> float:
+import functools
+from itertools import pairwise
+from typing import TYPE_CHECKING
+
+# rssn imports this module, so Shape is only needed for annotations here
+if TYPE_CHECKING:
+    from recursion.rssn import Shape, ShapeArrays, _Node
+
+try:
+    import numpy as np
+    from numba import njit, prange
+except ImportError:  # numba is optional; the flat density kernels then run as plain Python
+    njit = None
+    prange = range
+
+# Opcodes of flattened shapes (see Shape._op). Leaves read their per-depth values from a table.
+OP_LEAF, OP_AND, OP_OR, OP_NOT, OP_IMP, OP_XOR, OP_EQUIV, OP_NAND, OP_NOR = range(9)
+
+# Evaluates a shape tree at one depth with an explicit stack instead of recursive evaluate calls.
+# Connectives (shapes with _combine) are expanded; leaf shapes are evaluated directly.
+def evaluate_iterative(shape: Shape, depth: int) -> float:
+    results = []
+    stack = [(shape, False)]
+    while stack:
+        node, expanded = stack.pop()
+        combine = node._combine
+        if combine is None:
+            results.append(node.evaluate(depth))
+        elif expanded:
+            n = len(node._fields)
+            args = results[-n:]
+            del results[-n:]
+            results.append(combine(*args))
+        else:
+            stack.append((node, True))
+            for f in reversed(node._fields):
+                stack.append((getattr(node, f), False))
+    return results[0]
+
+# Values of a shape tree at depths 1..max_depth from one post-order walk. Each distinct node
+# (interned sub-shapes are shared) is visited once and combined across all depths at a time.
+def evaluate_all_depths(shape: Shape, max_depth: int) -> list[float]:
+    depths = range(1, max_depth + 1)
+    rows = {}
+    stack = [(shape, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if id(node) in rows:
+            continue
+        combine = node._combine
+        if combine is None:
+            rows[id(node)] = [node.evaluate(d) for d in depths]
+        elif expanded:
+            args = [rows[id(getattr(node, f))] for f in node._fields]
+            rows[id(node)] = [combine(*vals) for vals in zip(*args, strict=True)]
+        else:
+            stack.append((node, True))
+            for f in reversed(node._fields):
+                stack.append((getattr(node, f), False))
+    return rows[id(shape)]
+
+# Computes the density of a recursive shape across increasing depth levels.
+# Given a threshold and a bounded shape (see Shape.bounded), stops as soon as the comparison
+# against it is decided, assuming every level lies in [lower_bound, upper_bound]; the result
+# is then a bound on the correct side of the threshold rather than the exact density.
+# Early exit is abandoned once a level falls outside the bounds. Unbounded shapes (numeric
+# leaves) can jump past the bounds at any later level, so they always get the exact density.
+def compute_density(shape: Shape, max_depth: int = 10, threshold: float | None = None,
+                    lower_bound: float = 0.0, upper_bound: float = 1.0) -> float:
+    assert max_depth >= 1, max_depth
+    if threshold is None or not shape.bounded():
+        return sum(evaluate_all_depths(shape, max_depth)) / max_depth
     total_density = 0.0
+    bounded = True
     for d in range(1, max_depth + 1):
-        total_density += shape.evaluate(d)
+        val = evaluate_iterative(shape, d)
+        total_density += val
+        if bounded:
+            if not lower_bound <= val <= upper_bound:
+                bounded = False
+                continue
+            remaining = max_depth - d
+            low = (total_density + remaining * lower_bound) / max_depth
+            if low >= threshold:
+                return low
+            high = (total_density + remaining * upper_bound) / max_depth
+            if high < threshold:
+                return high
     return total_density / max_depth
 
+# Truth function of a connective opcode
+def _apply_op(op, a, b):
+    if op == OP_AND:
+        return min(a, b)
+    elif op == OP_OR:
+        return max(a, b)
+    elif op == OP_NOT:
+        return 1.0 - a
+    elif op == OP_IMP:
+        return 1.0 if a <= b else 0.0
+    elif op == OP_XOR:
+        return abs(a - b)
+    elif op == OP_EQUIV:
+        return 1.0 if abs(a - b) < 1e-6 else 0.0
+    elif op == OP_NAND:
+        return 1.0 - min(a, b)
+    else:
+        return 1.0 - max(a, b)
+
+# Combines a flattened shape (see Shape.flatten) bottom-up for every depth and averages the root.
+# Every node comes before its operands, so a reverse sweep sees operands first.
+def _density_kernel(node_type, child_start, child_count, children, weight, max_depth):
+    n = len(node_type)
+    vals = [0.0] * n
+    total = 0.0
+    for d in range(max_depth):
+        for i in range(n - 1, -1, -1):
+            op = node_type[i]
+            if op == OP_LEAF:
+                vals[i] = weight[i * max_depth + d]
+            else:
+                c = child_start[i]
+                vals[i] = _apply_op(op, vals[children[c]],
+                                    vals[children[c + 1]] if child_count[i] > 1 else 0.0)
+        total += vals[0]
+    return total / max_depth
+
+# Several flattened shapes concatenated: shape b owns nodes [node_offsets[b], node_offsets[b + 1])
+# and weights from weight_offsets[b]; child_start and children are global. vals is scratch space, one slot per node.
+def _batch_density_kernel(node_type, child_start, child_count, children, weight, node_offsets,
+                          weight_offsets, max_depths, vals, out):
+    for b in prange(len(out)):
+        lo = node_offsets[b]
+        hi = node_offsets[b + 1]
+        md = max_depths[b]
+        w0 = weight_offsets[b]
+        total = 0.0
+        for d in range(md):
+            for i in range(hi - 1, lo - 1, -1):
+                op = node_type[i]
+                if op == OP_LEAF:
+                    vals[i] = weight[w0 + (i - lo) * md + d]
+                else:
+                    c = child_start[i]
+                    vals[i] = _apply_op(op, vals[children[c]],
+                                        vals[children[c + 1]] if child_count[i] > 1 else 0.0)
+            total += vals[lo]
+        out[b] = total / md
+
+if njit is not None:
+    _apply_op = njit(cache=True, fastmath=True)(_apply_op)
+    _density_kernel = njit(cache=True, fastmath=True)(_density_kernel)
+    _batch_density_kernel = njit(cache=True, fastmath=True, parallel=True)(_batch_density_kernel)
+
+def _weight_dtype(weight):
+    return np.float32 if weight.typecode == "f" else np.float64
+
+# Density of a flattened shape via the (jitted, if numba is installed) kernel
+def density_of_arrays(arrays: ShapeArrays) -> float:
+    if njit is not None:
+        return _density_kernel(np.frombuffer(arrays.node_type, dtype=np.int8),
+                               np.frombuffer(arrays.child_start, dtype=np.intc),
+                               np.frombuffer(arrays.child_count, dtype=np.intc),
+                               np.frombuffer(arrays.children, dtype=np.intc),
+                               np.frombuffer(arrays.weight, dtype=_weight_dtype(arrays.weight)),
+                               arrays.max_depth)
+    return _density_kernel(arrays.node_type, arrays.child_start, arrays.child_count,
+                           arrays.children, arrays.weight, arrays.max_depth)
+
+# Densities of many flattened shapes in one kernel call (parallel over shapes under numba)
+def batch_density(arrays_list: list[ShapeArrays]) -> list[float]:
+    node_type, child_start, child_count, children, weight = [], [], [], [], []
+    node_offsets, weight_offsets, max_depths = [0], [], []
+    for arrays in arrays_list:
+        base = node_offsets[-1]
+        node_type.extend(arrays.node_type)
+        child_start.extend([c + len(children) for c in arrays.child_start])
+        child_count.extend(arrays.child_count)
+        children.extend([c + base for c in arrays.children])
+        weight_offsets.append(len(weight))
+        weight.extend(arrays.weight)
+        max_depths.append(arrays.max_depth)
+        node_offsets.append(len(node_type))
+    if njit is not None:
+        out = np.empty(len(arrays_list))
+        _batch_density_kernel(np.asarray(node_type, dtype=np.int8), np.asarray(child_start, dtype=np.intc),
+                              np.asarray(child_count, dtype=np.intc), np.asarray(children, dtype=np.intc),
+                              np.asarray(weight, dtype=np.float64),
+                              np.asarray(node_offsets, dtype=np.intc), np.asarray(weight_offsets, dtype=np.intc),
+                              np.asarray(max_depths, dtype=np.intc), np.zeros(len(node_type)), out)
+        return out.tolist()
+    out = [0.0] * len(arrays_list)
+    _batch_density_kernel(node_type, child_start, child_count, children, weight, node_offsets,
+                          weight_offsets, max_depths, [0.0] * len(node_type), out)
+    return out
+
+def compute_density_flat(shape: Shape, max_depth: int = 10) -> float:
+    return density_of_arrays(shape.flatten(max_depth))
+
+# Density keyed by structural shape key (see Shape.key), so repeated checks of an unchanged shape are a lookup
+@functools.lru_cache(maxsize=4096)
+def _density_cached(shape_key: _Node, max_depth: int, threshold: float | None = None) -> float:
+    shape = shape_key.cls.from_key(shape_key).simplify()
+    if njit is not None:
+        return compute_density_flat(shape, max_depth)
+    return compute_density(shape, max_depth, threshold)
+
 # Logs the density of a shape at each level
-def compute_density_log(shape: Shape, max_depth: int = 10) -> List[float]:
-    densities = []
-    for d in range(1, max_depth + 1):
-        val = shape.evaluate(d)
-        densities.append(val)
-    return densities
+def compute_density_log(shape: Shape, max_depth: int = 10) -> list[float]:
+    return evaluate_all_depths(shape, max_depth)
 
 # Computes a weighted (harmonic decay) density average
 def compute_weighted_density(shape: Shape, max_depth: int = 10) -> float:
-    weighted_sum = 0.0
-    weight_total = 0.0
-    for d in range(1, max_depth + 1):
-        weight = 1.0 / d
-        weighted_sum += shape.evaluate(d) * weight
-        weight_total += weight
-    return weighted_sum / weight_total
+    weights = [1.0 / d for d in range(1, max_depth + 1)]
+    values = compute_density_log(shape, max_depth)
+    return sum([v * w for v, w in zip(values, weights, strict=True)]) / sum(weights)
+
+# Whether the last 3 steps of a density log (spanning its last 4 values) stay within epsilon
+def _converging(values: list[float], epsilon: float) -> bool:
+    return all(abs(b - a) < epsilon for a, b in pairwise(values[-4:]))
 
 # Checks if the density appears to be converging
 def is_converging(shape: Shape, max_depth: int = 10, epsilon: float = 0.01) -> bool:
-    values = compute_density_log(shape, max_depth)
-    diffs = [abs(values[i] - values[i-1]) for i in range(1, len(values))]
-    return all(diff < epsilon for diff in diffs[-3:])  # last 3 steps stable
+    return _converging(compute_density_log(shape, max_depth), epsilon)
 
 # Checks if a shape is at critical (0.5) density
 def is_critical(shape: Shape, depth: int = 10, threshold: float = 0.01) -> bool:
@@ -46,13 +239,16 @@ def implication_valid(premise: Shape, conclusion: Shape, depth: int = 10) -> boo
 # Detects oscillation or stability in recursive density (Fractal Closure)
 def is_stable(shape: Shape, max_depth: int = 20, epsilon: float = 0.01) -> bool:
     values = compute_density_log(shape, max_depth)
-    trend = [values[i] - values[i-1] for i in range(1, len(values))]
-    oscillations = [t1 * t2 < 0 for t1, t2 in zip(trend[:-1], trend[1:])]
-    return not any(oscillations[-3:]) and is_converging(shape, max_depth, epsilon)
+    # Only the last 3 sign changes of the trend count, and they involve only the last 5 values
+    tail = values[-5:]
+    trend = [b - a for a, b in pairwise(tail)]
+    if any(t1 * t2 < 0 for t1, t2 in pairwise(trend)):
+        return False
+    return _converging(values, epsilon)
 
 # Example usage:
-# from knuckledragger.recursion.rssn import *
-# from knuckledragger.recursion.ftc import compute_density, is_critical, implication_valid
+# from recursion.rssn import *
+# from recursion.ftc import compute_density, is_critical, implication_valid
 # s = AndShape(AtomicShape(True), NotShape(AtomicShape(False)))
 # print(compute_density(s))
 # print(is_critical(s))
@@ -1,73 +1,106 @@
 # knuckledragger/recursion/rsf.py
 
-from knuckledragger.recursion.rssn import (
-    Shape, AtomicShape, AndShape, OrShape, NotShape, ImpShape, XorShape, EquivShape,
-    NandShape, NorShape, TriangleShape, SquareShape, CircleShape,
-    PentagonShape, HexagonShape, AetherShape
+from collections.abc import Callable
+from itertools import accumulate
+from typing import Any
+
+from recursion.rssn import (
+    AetherShape,
+    AndShape,
+    AtomicShape,
+    CircleShape,
+    EquivShape,
+    HexagonShape,
+    ImpShape,
+    NandShape,
+    NorShape,
+    NotShape,
+    OrShape,
+    PentagonShape,
+    Shape,
+    SquareShape,
+    TriangleShape,
+    XorShape,
 )
-from typing import List, Callable, Any, Dict
+
 
 class RecursiveSet:
-    def __init__(self, generator: Callable[[int], List[Any]]):
+    def __init__(self, generator: Callable[[int], list[Any]]):
         self.generator = generator
 
-    def generate_members(self, depth: int) -> List[Any]:
+    def generate_members(self, depth: int) -> list[Any]:
         return self.generator(depth)
 
     def contains(self, x: Any, depth: int = 10) -> bool:
         return x in self.generate_members(depth)
 
-def generate_structure(shape: Shape, depth: int = 3) -> List[Any]:
+def generate_structure(shape: Shape, depth: int = 3) -> list[Any]:
     return [shape.evaluate(i) for i in range(1, depth + 1)]
 
 class RSFSchema:
     def __init__(self, shape: Shape):
         self.shape = shape
-        self.schema = generate_structure(shape, depth=4)
+        self._schema = None
+
+    # Most schemas are never described; evaluate the shape on first access only
+    @property
+    def schema(self) -> list[Any]:
+        if self._schema is None:
+            self._schema = generate_structure(self.shape, depth=4)
+        return self._schema
+
+    @schema.setter
+    def schema(self, schema: list[Any]):
+        self._schema = schema
 
     def describe(self) -> str:
         return f"RSFSchema[{self.shape.__class__.__name__} → {self.schema}]"
 
 # Rule templates for logical and structural interpretation
 
-def truth_static(n: int) -> List[bool]:
-    return [True for _ in range(n)]
+# First n entries of a repeating pattern, built by list repetition rather than per element
+def _periodic(pattern: list[Any], n: int) -> list[Any]:
+    return (pattern * (n // len(pattern) + 1))[:n]
+
+def truth_static(n: int) -> list[bool]:
+    return [True] * n
 
-def truth_alternating(n: int) -> List[bool]:
-    return [i % 2 == 0 for i in range(n)]
+def truth_alternating(n: int) -> list[bool]:
+    return _periodic([True, False], n)
 
-def truth_inverted(n: int) -> List[bool]:
-    return [not (i % 2 == 0) for i in range(n)]
+def truth_inverted(n: int) -> list[bool]:
+    return _periodic([False, True], n)
 
-def implication_chain(n: int) -> List[str]:
-    return ["p → q" if i % 2 == 0 else "q → p" for i in range(n)]
+def implication_chain(n: int) -> list[str]:
+    return _periodic(["p → q", "q → p"], n)
 
-def xor_balance(n: int) -> List[bool]:
-    return [(i % 3) == 1 for i in range(n)]
+def xor_balance(n: int) -> list[bool]:
+    return _periodic([False, True, False], n)
 
-def nand_or_gate(n: int) -> List[str]:
-    return ["NAND" if i % 2 == 0 else "NOR" for i in range(n)]
+def nand_or_gate(n: int) -> list[str]:
+    return _periodic(["NAND", "NOR"], n)
 
-def exponential_growth(n: int) -> List[int]:
-    return [2 ** i for i in range(n)]
+def exponential_growth(n: int) -> list[int]:
+    return [1 << i for i in range(n)]
 
-def triangular_growth(n: int) -> List[int]:
-    return [i * (i + 1) // 2 for i in range(n)]
+def triangular_growth(n: int) -> list[int]:
+    return list(accumulate(range(n)))
 
-def square_compound(n: int) -> List[int]:
-    return [sum([j ** 2 for j in range(1, i + 1)]) for i in range(n)]
+# Entry i is the sum of the terms for j in 1..i, kept as a running total
+def square_compound(n: int) -> list[int]:
+    return list(accumulate((j ** 2 for j in range(1, n)), initial=0))[:n]
 
-def circle_nested(n: int) -> List[int]:
-    return [sum([2 ** (j ** 2) for j in range(1, i + 1)]) for i in range(n)]
+def circle_nested(n: int) -> list[int]:
+    return list(accumulate((2 ** (j ** 2) for j in range(1, n)), initial=0))[:n]
 
-def pentagon_structured(n: int) -> List[str]:
-    return ["META" if i % 2 == 0 else "SELF" for i in range(n)]
+def pentagon_structured(n: int) -> list[str]:
+    return _periodic(["META", "SELF"], n)
 
-def hexagon_fusion(n: int) -> List[str]:
-    return ["CONVERGE" if i % 3 == 0 else "DIVERGE" for i in range(n)]
+def hexagon_fusion(n: int) -> list[str]:
+    return _periodic(["CONVERGE", "DIVERGE", "DIVERGE"], n)
 
-def aether_field(n: int) -> List[str]:
-    return ["∞" for _ in range(n)]
+def aether_field(n: int) -> list[str]:
+    return ["∞"] * n
 
 def describe_structure(shape: Shape, depth: int = 3) -> str:
     trace = generate_structure(shape, depth)
@@ -75,7 +108,7 @@ def describe_structure(shape: Shape, depth: int = 3) -> str:
 
 # Full RSF rule registry for programmatic access
 
-RSF_RULES: Dict[str, Callable[[int], List[Any]]] = {
+RSF_RULES: dict[str, Callable[[int], list[Any]]] = {
     'Atomic': truth_static,
     'And': truth_static,
     'Or': truth_alternating,
@@ -1,108 +1,463 @@
 # knuckledragger/recursion/rssn.py
 
-from abc import ABC, abstractmethod
-from typing import Union
-from knuckledragger.recursion.ftc import compute_density
+import functools
+import weakref
+from array import array
+from dataclasses import dataclass
+
+from recursion.ftc import (
+    OP_AND,
+    OP_EQUIV,
+    OP_IMP,
+    OP_LEAF,
+    OP_NAND,
+    OP_NOR,
+    OP_NOT,
+    OP_OR,
+    OP_XOR,
+    _density_cached,
+)
+
+
+@dataclass
+class ShapeArrays:
+    """
+    Structure-of-arrays form of a shape, one node per distinct sub-shape, so shared subtrees
+    are stored once. The root is node 0 and every node comes before its operands.
+    The operands of node i are nodes children[child_start[i]:child_start[i] + child_count[i]].
+    weight[i * max_depth + d - 1] is the value of leaf i at depth d (0.0 for connectives),
+    stored as float32 ("f") when that is exact and float64 ("d") otherwise.
+    """
+    node_type: array
+    child_start: array
+    child_count: array
+    children: array
+    weight: array
+    max_depth: int
+
+class _Node:
+    """
+    Interned structure of a shape: its class, its scalar fields, and the nodes of its sub-shapes.
+    Structurally equal shapes have the same node, so keys hash and compare by identity.
+    values caches the shape's value by depth, shared by every shape with this structure.
+    """
+    __slots__ = ("__weakref__", "args", "cls", "values")
+
+    def __init__(self, cls: type, args: tuple):
+        self.cls = cls
+        self.args = args
+        self.values = {}
+
+    # Copies and unpickled nodes are interned again, so they stay identical to the original
+    def __reduce__(self):
+        return (_intern, (self.cls, self.args))
+
+    def __repr__(self):
+        return f"_Node{(self.cls.__name__, *self.args)}"
+
+# Hash-consing of structure only: shapes themselves are separate objects with their own metadata.
+# Entries are keyed by the class plus sub-shape nodes (themselves interned) and typed scalar fields.
+_intern_table: "weakref.WeakValueDictionary[tuple, _Node]" = weakref.WeakValueDictionary()
+
+def _intern(cls: type, args: tuple) -> _Node:
+    key = (cls, *(a if isinstance(a, _Node) else (type(a), a) for a in args))
+    try:
+        node = _intern_table.get(key)
+    except TypeError:  # unhashable field value
+        return _Node(cls, args)
+    if node is None:
+        node = _intern_table[key] = _Node(cls, args)
+    return node
+
+def _memoized_evaluate(evaluate):
+    @functools.wraps(evaluate)
+    def wrapper(self, depth):
+        values = self.key().values
+        if depth in values:
+            return values[depth]
+        val = values[depth] = evaluate(self, depth)
+        return val
+    return wrapper
+
+class Shape:
+    # Instances carry no __dict__. _node caches key().
+    __slots__ = ("_node", "metadata")
+    # Constructor arguments, in order. Used to build structural keys.
+    _fields: tuple = ()
+    # Connectives combine the values of their sub-shapes (all of their fields) with this.
+    # None for leaf shapes, which are evaluated directly.
+    _combine = None
+    # Opcode of the connective in flattened shapes
+    _op = OP_LEAF
+    # (operand value, result value) of connectives with an absorbing atomic operand, e.g. False for And
+    _absorbing = None
+    # True if the value lies in [0, 1] whatever the operands. Otherwise connectives are bounded
+    # when their operands are, and leaves are not.
+    _bounded = None
+    # Whether evaluate results are cached per depth on the key; off for leaves cheaper than the lookup
+    _memoize = True
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "evaluate" in cls.__dict__ and cls._memoize:
+            cls.evaluate = _memoized_evaluate(cls.__dict__["evaluate"])
 
-class Shape(ABC):
     def __init__(self):
+        self._node = None
         self.metadata = {}
 
-    @abstractmethod
     def evaluate(self, depth: int) -> float:
-        pass
+        raise NotImplementedError
+
+    def key(self) -> _Node:
+        """
+        Hashable structural key, the same object for structurally equal shapes.
+        Shapes are not mutated once built, so it is computed once.
+        """
+        # Post-order over the sub-shapes still missing a key, with an explicit stack
+        stack = [self]
+        while stack:
+            shape = stack[-1]
+            if shape._node is not None:
+                stack.pop()
+                continue
+            args = [getattr(shape, f) for f in shape._fields]
+            pending = [a for a in args if isinstance(a, Shape) and a._node is None]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            shape._node = _intern(type(shape), tuple(a._node if isinstance(a, Shape) else a for a in args))
+        return self._node
+
+    @staticmethod
+    def from_key(key: _Node) -> "Shape":
+        # Built bottom-up with an explicit stack; a node shared in the key gives one shared shape
+        built = {}
+        stack = [key]
+        while stack:
+            node = stack[-1]
+            if node in built:
+                stack.pop()
+                continue
+            pending = [a for a in node.args if isinstance(a, _Node) and a not in built]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            shape = node.cls(*(built[a] if isinstance(a, _Node) else a for a in node.args))
+            shape._node = node
+            built[node] = shape
+        return built[key]
+
+    # Structural equality; metadata is not part of a shape's identity
+    def __eq__(self, other):
+        if not isinstance(other, Shape):
+            return NotImplemented
+        return self.key() is other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def with_replaced(self, path, new: "Shape") -> "Shape":
+        """
+        Copy of this shape with the sub-shape at `path` (a sequence of field indices) replaced by `new`.
+        Only the nodes along the path are rebuilt; every other sub-shape is shared.
+        """
+        path = list(path)
+        if not path:
+            return new
+        spine = [self]
+        for i in path[:-1]:
+            spine.append(getattr(spine[-1], spine[-1]._fields[i]))
+        for shape, i in zip(reversed(spine), reversed(path), strict=True):
+            args = [getattr(shape, f) for f in shape._fields]
+            args[i] = new
+            new = type(shape)(*args)
+        return new
+
+    def flatten(self, max_depth: int) -> ShapeArrays:
+        # Post-order walk with an explicit stack, visiting each sub-shape object once;
+        # reversed, it puts every node before its operands.
+        nodes = []
+        seen = set()
+        stack = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                nodes.append(node)
+            elif id(node) not in seen:
+                seen.add(id(node))
+                if node._combine is None:
+                    nodes.append(node)
+                else:
+                    stack.append((node, True))
+                    stack.extend((getattr(node, f), False) for f in node._fields)
+        nodes.reverse()
+        index = {id(node): i for i, node in enumerate(nodes)}
+        child_start = array("i")
+        child_count = array("i")
+        children = array("i")
+        for node in nodes:
+            operands = [getattr(node, f) for f in node._fields] if node._combine is not None else []
+            child_start.append(len(children))
+            child_count.append(len(operands))
+            children.extend([index[id(a)] for a in operands])
+        node_type = array("b", [node._op for node in nodes])
+        values = []
+        for node in nodes:
+            if node._combine is None:
+                values.extend([node.evaluate(d) for d in range(1, max_depth + 1)])
+            else:
+                values.extend([0.0] * max_depth)
+        # Leaf values are nearly always 0.0/1.0 or small integers, which float32 holds exactly.
+        # Fall back to float64 when any value would be rounded.
+        weight = array("f", values)
+        if weight.tolist() != values:
+            weight = array("d", values)
+        return ShapeArrays(node_type, child_start, child_count, children, weight, max_depth)
+
+    def bounded(self) -> bool:
+        """
+        Whether the value lies in [0, 1] at every depth. Numeric leaves are unbounded.
+        """
+        seen = set()
+        stack = [self]
+        while stack:
+            shape = stack.pop()
+            if shape._bounded:
+                continue
+            if shape._combine is None:
+                return False
+            for f in shape._fields:
+                operand = getattr(shape, f)
+                if id(operand) not in seen:
+                    seen.add(id(operand))
+                    stack.append(operand)
+        return True
+
+    def simplify(self) -> "Shape":
+        """
+        Shape with the same value at every depth, with Not(Not(x)) collapsed to x and
+        connectives decided by an absorbing atomic operand (And(Atomic(False), x), Or(Atomic(True), x),
+        Nand, Nor) replaced by their constant, provided the other operands are bounded.
+        """
+        # Post-order with an explicit stack. Each distinct sub-shape is simplified once, together with
+        # whether it is bounded, and sub-shapes that do not change are kept as they are.
+        done = {}  # id(shape) -> (simplified shape, bounded)
+        stack = [self]
+        while stack:
+            shape = stack[-1]
+            if id(shape) in done:
+                stack.pop()
+                continue
+            if shape._combine is None:
+                stack.pop()
+                done[id(shape)] = (shape, bool(shape._bounded))
+                continue
+            operands = [getattr(shape, f) for f in shape._fields]
+            pending = [a for a in operands if id(a) not in done]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            args = [done[id(a)][0] for a in operands]
+            bounded = bool(shape._bounded) or all(done[id(a)][1] for a in operands)
+            absorbing = shape._absorbing
+            if (absorbing is not None and bounded
+                    and any(type(a) is AtomicShape and bool(a.value) == absorbing[0] for a in args)):
+                done[id(shape)] = (AtomicShape(absorbing[1]), True)
+            elif type(shape) is NotShape and type(args[0]) is NotShape:
+                done[id(shape)] = (args[0].shape, bounded)
+            elif any(a is not o for a, o in zip(args, operands, strict=True)):
+                done[id(shape)] = (type(shape)(*args), bounded)
+            else:
+                done[id(shape)] = (shape, bounded)
+        return done[id(self)][0]
 
     def __repr__(self):
-        return self.__class__.__name__ + str(self.__dict__)
+        fields = {"metadata": self.metadata}
+        fields.update((f, getattr(self, f)) for f in self._fields)
+        return self.__class__.__name__ + str(fields)
 
 class AtomicShape(Shape):
+    _fields = ("value",)
+    __slots__ = ("_v", "value")
+    _memoize = False
+    _bounded = True
+
     def __init__(self, value: bool):
         super().__init__()
         self.value = value
+        # The value at every depth, fixed at construction
+        self._v = 1.0 if value else 0.0
 
     def evaluate(self, depth: int) -> float:
-        return 1.0 if self.value else 0.0
+        return self._v
 
 class AndShape(Shape):
+    _fields = ("left", "right")
+    __slots__ = ("left", "right")
+    _op = OP_AND
+    _absorbing = (False, False)
+
     def __init__(self, left: Shape, right: Shape):
         super().__init__()
         self.left = left
         self.right = right
 
+    @staticmethod
+    def _combine(l, r) -> float:
+        return min(l, r)
+
     def evaluate(self, depth: int) -> float:
-        return min(self.left.evaluate(depth), self.right.evaluate(depth))
+        return self._combine(self.left.evaluate(depth), self.right.evaluate(depth))
 
 class OrShape(Shape):
+    _fields = ("left", "right")
+    __slots__ = ("left", "right")
+    _op = OP_OR
+    _absorbing = (True, True)
+
     def __init__(self, left: Shape, right: Shape):
         super().__init__()
         self.left = left
         self.right = right
 
+    @staticmethod
+    def _combine(l, r) -> float:
+        return max(l, r)
+
     def evaluate(self, depth: int) -> float:
-        return max(self.left.evaluate(depth), self.right.evaluate(depth))
+        return self._combine(self.left.evaluate(depth), self.right.evaluate(depth))
 
 class NotShape(Shape):
+    _fields = ("shape",)
+    __slots__ = ("shape",)
+    _op = OP_NOT
+
     def __init__(self, shape: Shape):
         super().__init__()
         self.shape = shape
 
+    @staticmethod
+    def _combine(v) -> float:
+        return 1.0 - v
+
     def evaluate(self, depth: int) -> float:
-        return 1.0 - self.shape.evaluate(depth)
+        return self._combine(self.shape.evaluate(depth))
 
 class ImpShape(Shape):
+    _fields = ("premise", "conclusion")
+    __slots__ = ("conclusion", "premise")
+    _op = OP_IMP
+    _bounded = True
+
     def __init__(self, premise: Shape, conclusion: Shape):
         super().__init__()
         self.premise = premise
         self.conclusion = conclusion
 
+    @staticmethod
+    def _combine(p, c) -> float:
+        return 1.0 if p <= c else 0.0
+
     def evaluate(self, depth: int) -> float:
-        return 1.0 if self.premise.evaluate(depth) <= self.conclusion.evaluate(depth) else 0.0
+        return self._combine(self.premise.evaluate(depth), self.conclusion.evaluate(depth))
 
 class XorShape(Shape):
+    _fields = ("left", "right")
+    __slots__ = ("left", "right")
+    _op = OP_XOR
+
     def __init__(self, left: Shape, right: Shape):
         super().__init__()
         self.left = left
         self.right = right
 
+    @staticmethod
+    def _combine(l, r) -> float:
+        return abs(l - r)
+
     def evaluate(self, depth: int) -> float:
-        return abs(self.left.evaluate(depth) - self.right.evaluate(depth))
+        return self._combine(self.left.evaluate(depth), self.right.evaluate(depth))
 
 class EquivShape(Shape):
+    _fields = ("left", "right")
+    __slots__ = ("left", "right")
+    _op = OP_EQUIV
+    _bounded = True
+
     def __init__(self, left: Shape, right: Shape):
         super().__init__()
         self.left = left
         self.right = right
 
+    @staticmethod
+    def _combine(l, r) -> float:
+        return 1.0 if abs(l - r) < 1e-6 else 0.0
+
     def evaluate(self, depth: int) -> float:
-        return 1.0 if abs(self.left.evaluate(depth) - self.right.evaluate(depth)) < 1e-6 else 0.0
+        return self._combine(self.left.evaluate(depth), self.right.evaluate(depth))
 
 class NandShape(Shape):
+    _fields = ("left", "right")
+    __slots__ = ("left", "right")
+    _op = OP_NAND
+    _absorbing = (False, True)
+
     def __init__(self, left: Shape, right: Shape):
         super().__init__()
         self.left = left
         self.right = right
 
+    @staticmethod
+    def _combine(l, r) -> float:
+        return 1.0 - min(l, r)
+
     def evaluate(self, depth: int) -> float:
-        return 1.0 - min(self.left.evaluate(depth), self.right.evaluate(depth))
+        return self._combine(self.left.evaluate(depth), self.right.evaluate(depth))
 
 class NorShape(Shape):
+    _fields = ("left", "right")
+    __slots__ = ("left", "right")
+    _op = OP_NOR
+    _absorbing = (True, False)
+
     def __init__(self, left: Shape, right: Shape):
         super().__init__()
         self.left = left
         self.right = right
 
+    @staticmethod
+    def _combine(l, r) -> float:
+        return 1.0 - max(l, r)
+
     def evaluate(self, depth: int) -> float:
-        return 1.0 - max(self.left.evaluate(depth), self.right.evaluate(depth))
+        return self._combine(self.left.evaluate(depth), self.right.evaluate(depth))
+
+# SquareShape(v).evaluate(1) and CircleShape(v).evaluate(1), without building the shape
+def _self_power(v) -> float:
+    return float(v ** v) if v >= 1 else float(v)
 
 class TriangleShape(Shape):
+    _fields = ("n",)
+    __slots__ = ("n",)
+
     def __init__(self, n: int):
         super().__init__()
         self.n = n
 
     def evaluate(self, depth: int) -> float:
-        return float(self.n ** self.n) if depth == 1 else TriangleShape(self.n).evaluate(depth - 1)
+        # Every depth bottoms out at depth 1 unchanged
+        if depth < 1:
+            raise ValueError(f"depth must be >= 1, got {depth}")
+        return float(self.n ** self.n)
 
 class SquareShape(Shape):
+    _fields = ("n",)
+    __slots__ = ("n",)
+
     def __init__(self, n: int):
         super().__init__()
         self.n = n
@@ -114,6 +469,9 @@ class SquareShape(Shape):
         return float(val)
 
 class CircleShape(Shape):
+    _fields = ("n",)
+    __slots__ = ("n",)
+
     def __init__(self, n: int):
         super().__init__()
         self.n = n
@@ -121,42 +479,56 @@ class CircleShape(Shape):
     def evaluate(self, depth: int) -> float:
         val = self.n
         for _ in range(min(depth, self.n)):
-            val = SquareShape(val).evaluate(1)
+            val = _self_power(val)
         return float(val)
 
+# PentagonShape(n).evaluate(depth), also used by HexagonShape without building a shape per step
+def _pentagon_value(n, depth: int) -> float:
+    # Shared across depths and instances
+    d3 = _density_cached(CircleShape(n).key(), 3)
+    effective_depth = int(depth * d3)
+    val = n
+    for _ in range(effective_depth):
+        val = _self_power(val)
+    return float(val)
+
 class PentagonShape(Shape):
+    _fields = ("n",)
+    __slots__ = ("n",)
+
     def __init__(self, n: int):
         super().__init__()
         self.n = n
 
     def evaluate(self, depth: int) -> float:
-        d3 = compute_density(CircleShape(self.n), max_depth=3)
-        effective_depth = int(depth * d3)
-        val = self.n
-        for _ in range(effective_depth):
-            val = CircleShape(val).evaluate(1)
-        return float(val)
+        return _pentagon_value(self.n, depth)
 
 class HexagonShape(Shape):
+    _fields = ("n",)
+    __slots__ = ("n",)
+
     def __init__(self, n: int):
         super().__init__()
         self.n = n
 
     def evaluate(self, depth: int) -> float:
-        d4 = compute_density(PentagonShape(self.n), max_depth=4)
+        d4 = _density_cached(PentagonShape(self.n).key(), 4)
         effective_depth = int(depth * d4)
         val = self.n
         for _ in range(effective_depth):
-            val = PentagonShape(val).evaluate(1)
+            val = _pentagon_value(val, 1)
         return float(val)
 
 class AetherShape(Shape):
+    _fields = ("n",)
+    __slots__ = ("n",)
+
     def __init__(self, n: int):
         super().__init__()
         self.n = n
 
     def evaluate(self, depth: int) -> float:
         val = self.n
-        for k in range(1, depth + 1):
-            val = TriangleShape(val).evaluate(1)
+        for _ in range(depth):
+            val = float(val ** val)
         return float(val)
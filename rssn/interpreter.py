@@ -1,6 +1,12 @@
 # knuckledragger/rssn/interpreter.py
 
-from knuckledragger.recursion.rssn import *
+import functools
+import re
+
+import lark
+
+from recursion.rssn import *
+from recursion.rssn import Shape, ShapeArrays
 
 SYMBOL_MAP = {
     'Atomic': AtomicShape,
@@ -20,24 +26,64 @@ SYMBOL_MAP = {
     'Aether': AetherShape,
 }
 
+# Expressions are calls of a SYMBOL_MAP name on shapes, integers, or (for Atomic) True/False
+_GRAMMAR = r"""
+?start: shape
+shape: NAME "(" (arg ("," arg)*)? ")"
+?arg: shape
+    | INT -> number
+    | NAME -> name
+NAME: /[A-Za-z_]\w*/
+%import common.INT
+%import common.WS
+%ignore WS
+"""
+
+class _ShapeBuilder(lark.Transformer):
+    """
+    Builds shapes bottom-up while the LALR parser reduces, so no parse tree is materialized.
+    """
+    def shape(self, children):
+        name, *args = children
+        if name == 'Atomic':
+            return AtomicShape(args == ['True'])
+        cls = SYMBOL_MAP.get(name)
+        if cls is None or any(isinstance(a, str) for a in args):
+            raise ValueError(f"Unrecognized expression: {name}({', '.join(map(str, args))})")
+        return cls(*args)
+
+    def number(self, children):
+        return int(children[0])
+
+    def name(self, children):
+        return str(children[0])
+
+_PARSER = lark.Lark(_GRAMMAR, parser="lalr", transformer=_ShapeBuilder())
+
+# Parses are cached as structural keys: each caller gets its own shapes (and metadata),
+# which share the cached values of the key.
+@functools.lru_cache(maxsize=4096)
+def _parse_key(expr: str):
+    try:
+        return _PARSER.parse(expr).key()
+    except lark.LarkError as e:
+        raise ValueError(f"Unrecognized expression: {expr.strip()}") from e
+
 def parse_expression(expr: str) -> Shape:
     """
-    Recursively parses an RSSN symbolic expression like:
+    Parses an RSSN symbolic expression like:
     Pentagon(2), Or(Atomic(True), Not(Atomic(False)))
     """
-    expr = expr.strip()
-    if expr.startswith('Atomic'):
-        val = expr[expr.find('(')+1:-1].strip()
-        return AtomicShape(val == 'True')
+    return Shape.from_key(_parse_key(expr))
 
-    for key in SYMBOL_MAP:
-        if expr.startswith(key):
-            args_str = expr[len(key)+1:-1]
-            args = split_args(args_str)
-            parsed_args = [parse_expression(arg) if not arg.isnumeric() else int(arg) for arg in args]
-            return SYMBOL_MAP[key](*parsed_args)
+def compile_expression(expr: str, max_depth: int = 10) -> ShapeArrays:
+    """
+    Lowers an expression to flat opcode arrays (see Shape.flatten), with leaf
+    values precomputed for depths 1..max_depth, for ftc.density_of_arrays.
+    """
+    return parse_expression(expr).flatten(max_depth)
 
-    raise ValueError(f"Unrecognized expression: {expr}")
+_DELIMITERS = re.compile(r"[(),]")
 
 def split_args(arg_str: str) -> list:
     """
@@ -46,21 +92,22 @@ def split_args(arg_str: str) -> list:
     """
     args = []
     depth = 0
-    current = []
-    for char in arg_str:
+    start = 0
+    # Only parentheses and commas matter; jump between them instead of visiting every character
+    for m in _DELIMITERS.finditer(arg_str):
+        char = m.group()
         if char == '(':
             depth += 1
         elif char == ')':
             depth -= 1
-        if char == ',' and depth == 0:
-            args.append(''.join(current).strip())
-            current = []
-        else:
-            current.append(char)
-    if current:
-        args.append(''.join(current).strip())
+        elif depth == 0:
+            args.append(arg_str[start:m.start()].strip())
+            start = m.end()
+    if start < len(arg_str):
+        args.append(arg_str[start:].strip())
     return args
 
 # Example usage:
 # shape = parse_expression("Pentagon(2)")
 # print(shape.evaluate(5))
+# print(density_of_arrays(compile_expression("Or(Atomic(True), Not(Atomic(False)))")))
@@ -1,10 +1,10 @@
 # knuckledragger/tactics/rssn_tactic.py
 
-from knuckledragger.recursion.ftc import compute_density, is_critical, is_converging
-from knuckledragger.recursion.rssn import Shape
-from knuckledragger.rssn.interpreter import parse_expression
-from knuckledragger.core.goal import Goal
-from knuckledragger.core.tactic import Tactic
+from recursion.ftc import density_of_arrays, is_critical, is_converging
+from recursion.rssn import Shape
+from rssn.interpreter import parse_expression
+from core.goal import Goal
+from core.tactic import Tactic
 
 class RSSNEvalTactic(Tactic):
     def __init__(self, expr: str, max_depth: int = 10):
@@ -13,7 +13,7 @@ class RSSNEvalTactic(Tactic):
 
     def apply(self, goal: Goal):
         shape = parse_expression(self.expr)
-        density = compute_density(shape, self.max_depth)
+        density = density_of_arrays(shape.flatten(self.max_depth))
         summary = {
             'expr': self.expr,
             'density': density,
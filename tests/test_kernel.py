@@ -381,4 +381,93 @@ def test_smart_prove():
     #with pytest.raises(Exception) as _:
     #    kd.prove(smt.ForAll([x], f(x) == g(x)), unfold=[g])
     with pytest.raises(kd.kernel.LemmaError):
-        kd.prove(smt.ForAll([x], d(x) == x+1), unfold=1)
\ No newline at end of file
+        kd.prove(smt.ForAll([x], d(x) == x+1), unfold=1)
+
+def test_prove_cache():
+    x = smt.Int("x")
+    kd.tactics.clear_prove_cache()
+    pf1 = kd.prove(smt.ForAll([x], x + 1 > x))
+    pf2 = kd.prove(smt.ForAll([x], x + 1 > x))
+    assert pf1 is pf2
+    kd.tactics.clear_prove_cache()
+    assert kd.prove(smt.ForAll([x], x + 1 > x)) is not pf1
+
+def test_prove_cache_bounded(monkeypatch):
+    x = smt.Int("x")
+    monkeypatch.setattr(kd.tactics, "_CACHE_SIZE", 2)
+    kd.tactics.clear_prove_cache()
+    for n in range(5):
+        kd.prove(x + n >= x)
+    assert len(kd.tactics._prove_cache) == 2
+    kd.tactics._and_ctx([x > 0, x > 1])
+    assert kd.tactics._and_cache
+    kd.tactics.clear_prove_cache()
+    assert not kd.tactics._prove_cache and not kd.tactics._and_cache
+
+def test_auto_prove_core(monkeypatch):
+    x = smt.Int("x")
+    f = smt.Function("f", smt.IntSort(), smt.IntSort())
+    lem = kd.axiom(smt.ForAll([x], f(x) > x))
+    unused = kd.prove(x + 1 > x)
+    kd.tactics.clear_prove_cache()
+    goal = f(x) > x - 1
+    kd.tactics._auto_prove([], goal, [lem, unused])
+    pinned, cores = kd.tactics._unsat_core_cache[goal.get_id()]
+    assert pinned.eq(goal) and cores == [frozenset([lem.thm.get_id()])]
+    # A core that does not suffice falls back to all of `by`
+    kd.tactics.clear_prove_cache()
+    monkeypatch.setattr(kd.tactics, "_auto_core", lambda *args: frozenset())
+    kd.tactics._auto_prove([], goal, [lem, unused])
+    # With a single lemma there is nothing to narrow, so no core query is made
+    kd.tactics.clear_prove_cache()
+    monkeypatch.setattr(kd.tactics, "_auto_core", None)
+    kd.tactics._auto_prove([], f(x) > x - 2, [lem])
+
+def test_auto_all_parallel():
+    x = smt.Int("x")
+    f = smt.Function("f", smt.IntSort(), smt.IntSort())
+    lem = kd.axiom(smt.ForAll([x], f(x) > x))
+    l = kd.Lemma(smt.And(f(x) > x - 1, x + 1 > x, f(x) >= x))
+    l.split()
+    assert len(l.goals) == 3
+    l.auto_all(by=[lem], parallel=True, max_workers=2)
+    assert len(l.goals) == 0
+    l.qed()
+    l = kd.Lemma(smt.And(f(x) > x - 1, f(x) > x + 1))
+    l.split()
+    with pytest.raises(kd.kernel.LemmaError):
+        l.auto_all(by=[lem], parallel=True)
+    assert len(l.goals) == 1
+
+def test_stack():
+    s = kd.tactics._Stack([1, 2])
+    t = s.copy()
+    t.append(3)
+    t[-1] = 4
+    assert list(s) == [1, 2] and list(t) == [1, 2, 4]
+    assert t.pop() == 4 and t.pop() == 2
+    assert list(s) == [1, 2] and len(s) == 2 and len(t) == 1
+    assert s[-1] == 2 and s[0] == 1
+    with pytest.raises(IndexError):
+        s[0] = 5
+    t.pop()
+    with pytest.raises(IndexError):
+        t.pop()
+    l = kd.Lemma(smt.BoolVal(True))
+    l2 = l.copy()
+    l2.auto()
+    assert len(l.goals) == 1 and len(l2.goals) == 0
+
+def test_prove_cache_provenance():
+    x = smt.Int("x")
+    f = smt.Function("f", smt.IntSort(), smt.IntSort())
+    thm = smt.ForAll([x], f(x) >= x)
+    admitted = kd.axiom(thm)
+    proved = kd.prove(thm, by=[kd.axiom(smt.ForAll([x], f(x) == x))])
+    kd.tactics.clear_prove_cache()
+    goal = f(x) + 1 > x
+    pf1 = kd.prove(goal, by=[admitted])
+    pf2 = kd.prove(goal, by=[proved])
+    assert pf1.reason[0] is admitted
+    assert pf2.reason[0] is proved
+    assert kd.prove(goal, by=[admitted]) is pf1
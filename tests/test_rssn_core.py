@@ -1,5 +1,5 @@
 import pytest
-from knuckledragger.recursion.rssn import (
+from recursion.rssn import (
     TriangleShape,
     SquareShape,
     CircleShape,
@@ -0,0 +1,197 @@
+import copy
+import pickle
+
+import pytest
+
+from recursion.rssn import (
+    AndShape, AtomicShape, CircleShape, ImpShape, NotShape, OrShape, Shape, SquareShape,
+    TriangleShape, XorShape
+)
+from recursion.ftc import batch_density, compute_density, compute_density_flat, density_of_arrays
+from core.goal import Goal, batch_is_satisfied
+from core.proof_state import ProofState
+from rssn.interpreter import compile_expression, parse_expression, split_args
+
+
+def test_intern_structure():
+    a = AndShape(AtomicShape(True), NotShape(AtomicShape(False)))
+    b = AndShape(AtomicShape(True), NotShape(AtomicShape(False)))
+    assert a is not b
+    assert a == b and hash(a) == hash(b)
+    assert a.key() is b.key()
+    assert a != OrShape(AtomicShape(True), NotShape(AtomicShape(False)))
+    # Scalar fields are keyed with their type
+    assert AtomicShape(True) != AtomicShape(1)
+
+
+def test_intern_metadata_not_shared():
+    a = AndShape(AtomicShape(True), AtomicShape(False))
+    b = AndShape(AtomicShape(True), AtomicShape(False))
+    a.metadata["note"] = 1
+    assert b.metadata == {}
+    p = parse_expression("Or(Atomic(True), Not(Atomic(False)))")
+    p.metadata["note"] = 1
+    q = parse_expression("Or(Atomic(True), Not(Atomic(False)))")
+    assert p == q and q.metadata == {}
+
+
+def test_intern_shares_values():
+    a = SquareShape(2)
+    assert a.evaluate(3) == 256.0
+    assert 3 in SquareShape(2).key().values
+    assert compute_density(SquareShape(2), 3) == compute_density(a, 3)
+
+
+def test_copy_pickle_shape():
+    a = AndShape(AtomicShape(True), NotShape(AtomicShape(False)))
+    a.metadata["note"] = 1
+    for b in [copy.copy(a), copy.deepcopy(a), pickle.loads(pickle.dumps(a))]:
+        assert b == a and b.key() is a.key()
+        assert b.metadata == {"note": 1}
+
+
+def _not_chain(shape, n):
+    for _ in range(n):
+        shape = NotShape(shape)
+    return shape
+
+
+def test_deep_shape():
+    deep = _not_chain(AtomicShape(True), 3000)
+    assert Goal(deep).is_satisfied()
+    assert deep.bounded()
+    assert Shape.from_key(deep.key()) == deep
+    assert deep.simplify() == AtomicShape(True)
+    replaced = deep.with_replaced([0] * 3000, AtomicShape(False))
+    assert replaced.simplify() == AtomicShape(False)
+    assert not Goal(replaced).is_satisfied()
+
+
+def test_simplify():
+    x = SquareShape(2)
+    assert _not_chain(x, 2).simplify() is x
+    assert _not_chain(x, 3).simplify() == NotShape(x)
+    # Absorbing operands decide a connective only over bounded operands
+    assert AndShape(AtomicShape(False), x).simplify() == AndShape(AtomicShape(False), x)
+    assert AndShape(AtomicShape(False), ImpShape(x, x)).simplify() == AtomicShape(False)
+    assert OrShape(NotShape(NotShape(AtomicShape(True))), AtomicShape(False)).simplify() == AtomicShape(True)
+    unchanged = AndShape(AtomicShape(True), x)
+    assert unchanged.simplify() is unchanged
+    shared = AndShape(x, x)
+    assert AndShape(shared, shared).simplify().left is shared
+
+
+def test_with_replaced():
+    a = AndShape(NotShape(AtomicShape(True)), AtomicShape(False))
+    b = a.with_replaced([0, 0], AtomicShape(False))
+    assert b == AndShape(NotShape(AtomicShape(False)), AtomicShape(False))
+    assert b.right is a.right
+    assert a.with_replaced([], AtomicShape(True)) == AtomicShape(True)
+
+
+def test_flatten_shared():
+    x = AtomicShape(True)
+    for _ in range(22):
+        x = AndShape(x, x)
+    arrays = x.flatten(3)
+    assert len(arrays.node_type) == 23
+    assert density_of_arrays(arrays) == 1.0
+
+
+def test_flatten_layout():
+    leaf = AtomicShape(False)
+    s = ImpShape(NotShape(leaf), leaf)
+    arrays = s.flatten(2)
+    assert len(arrays.node_type) == 3
+    for i in range(len(arrays.node_type)):
+        operands = arrays.children[arrays.child_start[i]:arrays.child_start[i] + arrays.child_count[i]]
+        assert all(c > i for c in operands)
+    # Operands keep their field order
+    assert density_of_arrays(arrays) == 0.0
+    assert density_of_arrays(ImpShape(leaf, NotShape(leaf)).flatten(2)) == 1.0
+
+
+def test_flat_kernels_match():
+    shapes = [
+        OrShape(NotShape(AtomicShape(True)), XorShape(SquareShape(1), AtomicShape(False))),
+        AndShape(CircleShape(1), ImpShape(AtomicShape(True), AtomicShape(False))),
+        XorShape(AtomicShape(True), NotShape(XorShape(AtomicShape(False), AtomicShape(True)))),
+    ]
+    for depth in [1, 4]:
+        expected = [compute_density(s, depth) for s in shapes]
+        assert [compute_density_flat(s, depth) for s in shapes] == expected
+        assert batch_density([s.flatten(depth) for s in shapes]) == expected
+    assert batch_density([shapes[0].flatten(2), shapes[1].flatten(5)]) == [
+        compute_density(shapes[0], 2), compute_density(shapes[1], 5)
+    ]
+
+
+def test_goal_copy_and_assign():
+    g = Goal(AndShape(AtomicShape(True), SquareShape(1)), threshold=0.5, max_depth=3)
+    assert type(g) is Goal
+    assert g.is_satisfied()
+    for h in [copy.copy(g), copy.deepcopy(g), pickle.loads(pickle.dumps(g))]:
+        assert type(h) is Goal and h.shape == g.shape
+        assert (h.threshold, h.max_depth) == (0.5, 3)
+        assert h.is_satisfied()
+    g.threshold = 1.0
+    g.shape = AndShape(AtomicShape(True), AtomicShape(False))
+    assert not g.is_satisfied()
+    g.shape = AtomicShape(True)
+    g.max_depth = 5
+    assert g.is_satisfied()
+    with pytest.raises(ValueError):
+        g.threshold = 1.5
+    with pytest.raises(ValueError):
+        Goal(AtomicShape(True), max_depth=0)
+
+
+class _Tactic:
+    def __init__(self, apply):
+        self.apply = apply
+
+
+def test_proof_state_loop():
+    state = ProofState(Goal(AndShape(AtomicShape(True), AtomicShape(True))))
+    assert state.is_proven()
+    state.apply_tactic(_Tactic(lambda goal: goal.shape))
+    assert state.looped and state.is_proven()
+    state = ProofState(Goal(AtomicShape(False)))
+    state.apply_tactic(_Tactic(lambda goal: ([], NotShape(goal.shape))))
+    assert not state.looped and state.is_proven()
+    state.apply_tactic(_Tactic(lambda goal: ([0], AtomicShape(True))))
+    assert not state.looped and not state.is_proven()
+    # A structurally equal shape built anew is still a revisit
+    state.apply_tactic(_Tactic(lambda goal: NotShape(AtomicShape(False))))
+    assert state.looped and state.is_proven()
+
+
+def test_parse_expression():
+    p = parse_expression("Or(Atomic(True), Not(Imp(Atomic(False), Square(2))))")
+    assert p == OrShape(AtomicShape(True), NotShape(ImpShape(AtomicShape(False), SquareShape(2))))
+    assert parse_expression(" Circle( 3 ) ") == CircleShape(3)
+    assert parse_expression("Atomic(False)") == AtomicShape(False)
+    for bad in ["Foo(1)", "And(Atomic(True))x", "Square(x)", "Not(", ""]:
+        with pytest.raises(ValueError):
+            parse_expression(bad)
+
+
+def test_compile_expression():
+    expr = "And(Or(Atomic(True), Atomic(False)), Not(Atomic(False)))"
+    arrays = compile_expression(expr, 4)
+    assert arrays.max_depth == 4
+    assert density_of_arrays(arrays) == compute_density(parse_expression(expr), 4)
+    assert split_args("Atomic(True), Not(Atomic(False))") == ["Atomic(True)", "Not(Atomic(False))"]
+
+
+def test_threshold_unbounded_shape():
+    shape = XorShape(SquareShape(2), TriangleShape(2))
+    assert compute_density(shape, 3) == 168.0
+    assert compute_density(shape, 3, threshold=0.95) == 168.0
+    assert Goal(shape, 0.95, 3).is_satisfied()
+    assert batch_is_satisfied([Goal(shape, 0.95, 3)]) == [True]
+    # Bounded shapes may still stop early on the correct side of the threshold
+    bounded = AndShape(AtomicShape(False), NotShape(AtomicShape(False)))
+    assert compute_density(bounded, 10, threshold=0.95) < 0.95
+    assert not Goal(bounded, 0.95, 10).is_satisfied()
+    assert batch_is_satisfied([Goal(bounded, 0.95, 10)]) == [False]